@@ -11,6 +11,11 @@ Outputs per topic in out_folder:
   - script_{topic}.txt   (human readable: summary + all scripts + segments)
   - script_{topic}.json  (machine friendly: summary, scripts, segments metadata)
 
+Topics are processed concurrently (asyncio), capped by --concurrency.
+Wikipedia summaries and OpenAI responses are cached under out_folder/.wiki_cache and
+out_folder/.ai_cache (see --cache_ttl), so re-runs only fetch what is missing.
+With --batch all prompts are sent as a single OpenAI Batch API job (cheaper; may take hours).
+
 Usage example:
   python auto_history_pipeline_timecode.py --topics "Đế chế La Mã,Napoleon" --lang vi --out_folder ./outputs
 
@@ -19,8 +24,16 @@ Environment variables (optional):
 """
 import os
 import argparse
+import asyncio
+import functools
+import hashlib
 import json
+import re
 import sys
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import quote
 
 # Ensure stdout/stderr use UTF-8 so printing unicode to Windows console won't crash
 try:
@@ -31,17 +44,48 @@ except Exception:
 
 # Optional imports
 try:
-    import wikipedia
-    WIKI_AVAILABLE = True
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    REQUESTS_AVAILABLE = True
+except Exception:
+    REQUESTS_AVAILABLE = False
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
 except Exception:
-    WIKI_AVAILABLE = False
+    AIOHTTP_AVAILABLE = False
 
 try:
-    import openai
+    from openai import AsyncOpenAI, RateLimitError, APITimeoutError
     OPENAI_AVAILABLE = True
 except Exception:
     OPENAI_AVAILABLE = False
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except Exception:
+    ORJSON_AVAILABLE = False
+
+try:
+    import aiofiles
+    AIOFILES_AVAILABLE = True
+except Exception:
+    AIOFILES_AVAILABLE = False
+
+try:
+    from tenacity import retry, stop_after_attempt, wait_random_exponential, retry_if_exception_type
+    TENACITY_AVAILABLE = True
+except Exception:
+    TENACITY_AVAILABLE = False
+
+# Read once: AI is used when a key is set and there is a transport for it
+# (aiohttp for the REST calls, or the openai SDK).
+_OPENAI_KEY = os.getenv("OPENAI_API_KEY")
+_USE_AI = bool(_OPENAI_KEY) and (AIOHTTP_AVAILABLE or OPENAI_AVAILABLE)
+
 # -------------------- Prompt templates --------------------
 PROMPT_LONG = {
     "vi": """Bạn là một nhà biên soạn nội dung lịch sử. Hãy viết một kịch bản tường thuật dài 300–500 từ về chủ đề: "{TOPIC}".
@@ -101,33 +145,341 @@ Language: English.
 Return plain text."""
 }
 
+@functools.lru_cache(maxsize=None)
+def _lang_key(lang: str):
+    return 'vi' if lang.startswith('vi') else 'en'
+
 # -------------------- Helpers --------------------
+class DiskCache:
+    """One JSON file per key under `folder`, plus an in-process memo.
+    Entries older than `ttl` seconds, or that are not a dict holding the
+    `required` fields, are treated as missing."""
+
+    def __init__(self, folder: str, ttl: float):
+        self.folder = folder
+        self.ttl = ttl
+        self.memo = {}
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha1("\x1f".join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+    def load(self, key: str, required=()):
+        data = self.memo.get(key)
+        if data is None:
+            try:
+                with open(os.path.join(self.folder, key + '.json'), encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                return None
+        # a corrupt or foreign entry is a miss (and gets overwritten by the next store)
+        if not isinstance(data, dict) or any(field not in data for field in required):
+            return None
+        fetched_at = data.get('fetched_at')
+        if not isinstance(fetched_at, (int, float)) or time.time() - fetched_at > self.ttl:
+            return None
+        self.memo[key] = data
+        return data
+
+    def load_many(self, keys, required=()):
+        # {key: data} for the keys that hit; one call so async callers need one thread hop
+        hits = {}
+        for key in keys:
+            data = self.load(key, required)
+            if data is not None:
+                hits[key] = data
+        return hits
+
+    def store_many(self, items: dict):
+        for key, data in items.items():
+            self.store(key, data)
+
+    def store(self, key: str, data: dict):
+        # Best effort: a failed cache write must never fail the fetch that produced `data`.
+        data = dict(data, fetched_at=time.time())
+        self.memo[key] = data
+        path = os.path.join(self.folder, key + '.json')
+        tmp_path = None
+        try:
+            # unique temp file per writer, then rename, so concurrent stores of one key
+            # don't race and a crash never leaves a half-written entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+WIKI_REST_SUMMARY_URL = "https://{lang}.wikipedia.org/api/rest_v1/page/summary/{title}"
+# Wikimedia asks API clients to identify themselves
+HTTP_USER_AGENT = "rclone-drive-backup/1.0"
+# Retry policy for Wikipedia, shared by the requests adapter and the aiohttp fetch
+WIKI_RETRIES = 3
+WIKI_BACKOFF = 0.5
+WIKI_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Shared across topics so TCP/TLS connections to Wikipedia are reused
+_http_session = None
+
+def _get_http_session():
+    global _http_session
+    if _http_session is None:
+        _http_session = requests.Session()
+        _http_session.headers['User-Agent'] = HTTP_USER_AGENT
+        retries = Retry(total=WIKI_RETRIES, backoff_factor=WIKI_BACKOFF, status_forcelist=WIKI_RETRY_STATUSES)
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retries)
+        _http_session.mount('https://', adapter)
+    return _http_session
+
+def _wiki_summary_url(topic: str, lang: str):
+    return WIKI_REST_SUMMARY_URL.format(lang=lang, title=quote(topic.replace(' ', '_'), safe=''))
+
+def _parse_wiki_summary(data: dict):
+    # The REST summary holds the lead extract in one response (no HTML parsing);
+    # it is returned as both the summary and the (truncated) full text.
+    extract = data.get('extract', '')
+    if not extract:
+        raise RuntimeError("Wikipedia không có nội dung tóm tắt cho chủ đề này.")
+    return extract, extract[:5000]
+
 def fetch_wikipedia_summary(topic: str, lang: str = "vi", sentences: int = 6):
-    if not WIKI_AVAILABLE:
-        raise RuntimeError("Package wikipedia không có. Cài: pip install wikipedia")
-    wikipedia.set_lang(lang)
-    summary = wikipedia.summary(topic, sentences=sentences)
-    page = wikipedia.page(topic)
-    return summary, page.content[:5000]
-
-def call_openai(prompt: str, model: str = "gpt-4o-mini"):
-    if not OPENAI_AVAILABLE:
-        raise RuntimeError("openai package not installed. pip install openai")
-    key = os.getenv("OPENAI_API_KEY")
-    if not key:
-        raise RuntimeError("OPENAI_API_KEY not set.")
-    openai.api_key = key
-    resp = openai.ChatCompletion.create(
+    # `sentences` is kept for compatibility (and the cache key); the REST endpoint
+    # decides the length of the lead extract.
+    if not REQUESTS_AVAILABLE:
+        raise RuntimeError("Package requests không có. Cài: pip install requests (hoặc aiohttp)")
+    resp = _get_http_session().get(_wiki_summary_url(topic, lang), timeout=30)
+    if resp.status_code != 200:
+        raise RuntimeError(f"Wikipedia REST API trả về HTTP {resp.status_code}")
+    return _parse_wiki_summary(resp.json())
+
+def wiki_cached(fetch):
+    # Adds a `cache` (DiskCache) keyword to an async Wikipedia fetcher, keyed on (lang, topic, sentences).
+    @functools.wraps(fetch)
+    async def wrapper(topic: str, lang: str = "vi", sentences: int = 6, cache=None, **kwargs):
+        if cache is None:
+            return await fetch(topic, lang, sentences, **kwargs)
+        key = DiskCache.key(lang, topic, sentences)
+        hit = await asyncio.to_thread(cache.load, key, ('summary', 'full'))
+        if hit is not None:
+            return hit['summary'], hit['full']
+        summary, full = await fetch(topic, lang, sentences, **kwargs)
+        await asyncio.to_thread(cache.store, key, {'summary': summary, 'full': full})
+        return summary, full
+    return wrapper
+
+class WikiRetryableError(RuntimeError):
+    """HTTP 429/5xx from Wikipedia; retried with backoff like the requests adapter."""
+
+_WIKI_RETRYABLE_ERRORS = (WikiRetryableError, asyncio.TimeoutError)
+if AIOHTTP_AVAILABLE:
+    _WIKI_RETRYABLE_ERRORS += (aiohttp.ClientConnectionError,)
+
+async def _fetch_wiki_aiohttp_once(session, topic: str, lang: str):
+    headers = {'User-Agent': HTTP_USER_AGENT}
+    async with session.get(_wiki_summary_url(topic, lang), headers=headers) as resp:
+        if resp.status in WIKI_RETRY_STATUSES:
+            raise WikiRetryableError(f"Wikipedia REST API trả về HTTP {resp.status}")
+        if resp.status != 200:
+            raise RuntimeError(f"Wikipedia REST API trả về HTTP {resp.status}")
+        data = await resp.json()
+    return _parse_wiki_summary(data)
+
+async def _fetch_wiki_aiohttp(session, topic: str, lang: str):
+    # up to WIKI_RETRIES retries on 429/5xx, timeouts and connection errors,
+    # sleeping WIKI_BACKOFF * 2**n between attempts (same policy as _get_http_session)
+    for attempt in range(WIKI_RETRIES + 1):
+        try:
+            return await _fetch_wiki_aiohttp_once(session, topic, lang)
+        except _WIKI_RETRYABLE_ERRORS:
+            if attempt == WIKI_RETRIES:
+                raise
+            await asyncio.sleep(WIKI_BACKOFF * 2 ** attempt)
+
+@wiki_cached
+async def fetch_wikipedia_summary_async(topic: str, lang: str = "vi", sentences: int = 6, session=None):
+    # Non-blocking variant of fetch_wikipedia_summary via aiohttp. `session` is the
+    # run-wide aiohttp.ClientSession (shared with the OpenAI calls); without one a
+    # short-lived session is opened, and without aiohttp the requests-based
+    # version runs in a worker thread.
+    if session is not None:
+        return await _fetch_wiki_aiohttp(session, topic, lang)
+    if not AIOHTTP_AVAILABLE:
+        return await asyncio.to_thread(fetch_wikipedia_summary, topic, lang, sentences)
+    async with aiohttp.ClientSession() as own_session:
+        return await _fetch_wiki_aiohttp(own_session, topic, lang)
+
+_openai_client = None
+
+def _get_openai_client():
+    # created lazily: AsyncOpenAI() raises immediately when no API key is configured
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(api_key=_OPENAI_KEY)
+    return _openai_client
+
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+OPENAI_MAX_TOKENS = 800
+
+class OpenAIRetryableError(RuntimeError):
+    """HTTP 429/5xx from the OpenAI REST API; worth retrying after a backoff."""
+
+_RETRYABLE_ERRORS = (OpenAIRetryableError, asyncio.TimeoutError)
+if OPENAI_AVAILABLE:
+    _RETRYABLE_ERRORS += (RateLimitError, APITimeoutError)
+
+def _with_retry(fn):
+    # up to 3 attempts with jittered exponential backoff; no-op without tenacity
+    if not TENACITY_AVAILABLE:
+        return fn
+    return retry(
+        stop=stop_after_attempt(3),
+        wait=wait_random_exponential(min=1, max=20),
+        retry=retry_if_exception_type(_RETRYABLE_ERRORS),
+        reraise=True
+    )(fn)
+
+class RateLimiter:
+    """Token-bucket throttle on requests/min and tokens/min shared by all OpenAI calls
+    (same scheme as openai-cookbook's api_request_parallel_processor.py)."""
+
+    def __init__(self, max_requests_per_minute: float, max_tokens_per_minute: float):
+        if max_requests_per_minute <= 0 or max_tokens_per_minute <= 0:
+            raise ValueError("rate limits must be > 0")
+        self.max_rpm = float(max_requests_per_minute)
+        self.max_tpm = float(max_tokens_per_minute)
+        # the request bucket holds at least one request, so limits below 1/min
+        # still let calls through (refilled at max_rpm, e.g. 0.5 -> one per 2 min)
+        self.request_bucket = max(1.0, self.max_rpm)
+        self.request_capacity = self.request_bucket
+        self.token_capacity = self.max_tpm
+        self.last_update = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int):
+        # a call estimated above the whole TPM budget would otherwise wait forever
+        tokens = min(tokens, self.max_tpm)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                elapsed = now - self.last_update
+                self.request_capacity = min(self.request_bucket, self.request_capacity + self.max_rpm * elapsed / 60.0)
+                self.token_capacity = min(self.max_tpm, self.token_capacity + self.max_tpm * elapsed / 60.0)
+                self.last_update = now
+                if self.request_capacity >= 1 and self.token_capacity >= tokens:
+                    self.request_capacity -= 1
+                    self.token_capacity -= tokens
+                    return
+                await asyncio.sleep(0.1)
+
+def _estimate_tokens(prompt: str):
+    # rough: ~4 chars per prompt token, plus the completion budget
+    return len(prompt) // 4 + OPENAI_MAX_TOKENS
+
+async def _call_openai_aiohttp(session, prompt: str, model: str, key: str, on_delta=None):
+    # Direct REST call over a shared aiohttp session; scales better than the SDK's
+    # httpx transport when many topics are in flight. With `on_delta` the response
+    # is streamed (server-sent events) and each text chunk is passed to it.
+    payload = {
+        'model': model,
+        'messages': [{"role":"user","content":prompt}],
+        'max_tokens': OPENAI_MAX_TOKENS,
+        'temperature': 0.7
+    }
+    if on_delta is not None:
+        payload['stream'] = True
+    headers = {'Authorization': f"Bearer {key}"}
+    async with session.post(OPENAI_CHAT_URL, json=payload, headers=headers) as resp:
+        if resp.status != 200:
+            body = await resp.text()
+            if resp.status == 429 or resp.status >= 500:
+                raise OpenAIRetryableError(f"OpenAI API error HTTP {resp.status}: {body}")
+            raise RuntimeError(f"OpenAI API error HTTP {resp.status}: {body}")
+        if on_delta is None:
+            data = await resp.json(content_type=None)
+            return data['choices'][0]['message']['content'].strip()
+        parts = []
+        async for raw in resp.content:
+            line = raw.decode('utf-8').strip()
+            if not line.startswith('data:'):
+                continue
+            chunk = line[len('data:'):].strip()
+            if chunk == '[DONE]':
+                break
+            choices = json.loads(chunk).get('choices') or []
+            delta = choices[0].get('delta', {}).get('content') if choices else None
+            if delta:
+                parts.append(delta)
+                on_delta(delta)
+    return "".join(parts).strip()
+
+async def _call_openai_sdk(prompt: str, model: str, on_delta=None):
+    resp = await _get_openai_client().chat.completions.create(
         model=model,
         messages=[{"role":"user","content":prompt}],
-        max_tokens=800,
-        temperature=0.7
+        max_tokens=OPENAI_MAX_TOKENS,
+        temperature=0.7,
+        stream=on_delta is not None
     )
-    return resp['choices'][0]['message']['content'].strip()
+    if on_delta is None:
+        return resp.choices[0].message.content.strip()
+    parts = []
+    async for chunk in resp:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            parts.append(delta)
+            on_delta(delta)
+    return "".join(parts).strip()
 
-def local_fallback_formatter_long(topic: str, summary: str, lang: str = "vi"):
+def _ai_cache_key(model: str, prompt: str):
+    return DiskCache.key(model, hashlib.sha1(prompt.encode('utf-8')).hexdigest())
+
+@_with_retry
+async def call_openai(prompt: str, model: str = "gpt-4o-mini", session=None, limiter=None, cache=None, on_delta=None,
+                      on_attempt=None):
+    # `session` is the run-wide aiohttp.ClientSession from main_async; without it
+    # the AsyncOpenAI SDK client is used. `limiter` is the run-wide RateLimiter,
+    # `cache` a DiskCache of earlier responses keyed on (model, prompt hash).
+    # `on_delta(text)` switches to a streamed response and receives each chunk;
+    # `on_attempt()` runs at the start of every (re)try, so a streaming caller can
+    # discard the chunks of a failed attempt before they are sent again.
+    if on_attempt is not None:
+        on_attempt()
+    if not _USE_AI:
+        raise RuntimeError("OPENAI_API_KEY not set or no OpenAI client installed (pip install aiohttp or openai).")
+    if session is None and not OPENAI_AVAILABLE:
+        raise RuntimeError("openai package not installed. pip install openai (or aiohttp)")
+    if cache is not None:
+        hit = await asyncio.to_thread(cache.load, _ai_cache_key(model, prompt), ('content',))
+        if hit is not None:
+            if on_delta is not None:
+                on_delta(hit['content'])
+            return hit['content']
+    if limiter is not None:
+        await limiter.acquire(_estimate_tokens(prompt))
+    if session is not None:
+        content = await _call_openai_aiohttp(session, prompt, model, _OPENAI_KEY, on_delta=on_delta)
+    else:
+        content = await _call_openai_sdk(prompt, model, on_delta=on_delta)
+    if cache is not None:
+        await asyncio.to_thread(cache.store, _ai_cache_key(model, prompt), {'content': content})
+    return content
+
+# Sentence tokenizer shared by the local formatters: one regex scan per summary
+_SENT_RE = re.compile(r'[^.\n]+')
+
+def _sentences(text: str):
+    return [m.group(0).strip() for m in _SENT_RE.finditer(text) if m.group(0).strip()]
+
+# The formatters accept pre-split `sents` so a topic's summary is tokenized once.
+def local_fallback_formatter_long(topic: str, summary: str, lang: str = "vi", sents=None):
     # Create a longer narrative by expanding summary sentences naively
-    sents = [s.strip() for s in summary.replace("\n"," ").split('.') if s.strip()]
+    if sents is None:
+        sents = _sentences(summary)
     intro = sents[0] if sents else f"{topic} là một chủ đề lịch sử thú vị."
     middle = " ".join(sents[1:6])
     closing = sents[6] if len(sents)>6 else ""
@@ -136,18 +488,20 @@ def local_fallback_formatter_long(topic: str, summary: str, lang: str = "vi"):
     else:
         return f"{intro}. {middle}. {closing}. If you want to learn more, subscribe for future videos."
 
-def local_fallback_formatter_fromsummary(summary: str, lang: str = "vi"):
+def local_fallback_formatter_fromsummary(summary: str, lang: str = "vi", sents=None):
     # Short rewrite: take first 4-6 sentences and make a compact narrative.
-    sents = [s.strip() for s in summary.replace('\n',' ').split('.') if s.strip()]
+    if sents is None:
+        sents = _sentences(summary)
     pts = sents[:6]
     if lang.startswith("vi"):
         return " ".join(pts) + " Nguồn: Wikipedia."
     else:
         return " ".join(pts) + " Sources: Wikipedia."
 
-def local_fallback_formatter_short(topic: str, summary: str, lang: str = "vi"):
+def local_fallback_formatter_short(topic: str, summary: str, lang: str = "vi", sents=None):
     # Create a short 3-point script from summary or topic
-    sents = [s.strip() for s in summary.replace("\n"," ").split('.') if s.strip()]
+    if sents is None:
+        sents = _sentences(summary)
     p1 = sents[0] if sents else f"{topic} có nhiều điều thú vị."
     p2 = sents[1] if len(sents)>1 else ""
     p3 = sents[2] if len(sents)>2 else ""
@@ -162,6 +516,15 @@ def local_fallback_formatter_short(topic: str, summary: str, lang: str = "vi"):
         cta = "Like and subscribe for more."
         return f"{hook}\n\n{body}\n\n{cta}"
 
+# Fixed 1-minute layout: (role, duration, start, end) in seconds
+_SEG_TEMPLATE = (
+    ('hook',    8,  0,  8),
+    ('point1', 15,  8, 23),
+    ('point2', 15, 23, 38),
+    ('point3', 15, 38, 53),
+    ('cta',     7, 53, 60),
+)
+
 # Timecode splitting for 1-minute short (uses short script)
 def split_script_to_segments(script_text: str, lang: str = "vi"):
     parts = [p.strip() for p in script_text.split('\n') if p.strip()]
@@ -176,111 +539,397 @@ def split_script_to_segments(script_text: str, lang: str = "vi"):
                 points.append(s)
     while len(points) < 3:
         points.append("")
-    segs = []
-    segs.append({'role':'hook','text':hook,'duration':8})
-    for i in range(3):
-        segs.append({'role':f'point{i+1}','text':points[i],'duration':15})
-    segs.append({'role':'cta','text':cta,'duration':7})
-    cur = 0
-    for s in segs:
-        s['start'] = cur
-        s['end'] = cur + s['duration']
-        cur = s['end']
-    return segs
-
-# Generate scripts using OpenAI if available, otherwise local fallbacks
-def generate_three_scripts(topic: str, summary: str, lang: str = "vi"):
-    lang_key = 'vi' if lang.startswith('vi') else 'en'
-    scripts = {'long':None, 'from_summary':None, 'short':None}
-    # Long narrative
-    try:
-        if OPENAI_AVAILABLE and os.getenv("OPENAI_API_KEY"):
-            prompt = PROMPT_LONG[lang_key].format(TOPIC=topic)
-            scripts['long'] = call_openai(prompt)
-        else:
-            scripts['long'] = local_fallback_formatter_long(topic, summary, lang)
-    except Exception as e:
-        scripts['long'] = local_fallback_formatter_long(topic, summary, lang)
-    # From summary
-    try:
-        if OPENAI_AVAILABLE and os.getenv("OPENAI_API_KEY"):
-            prompt = PROMPT_FROM_SUMMARY[lang_key].format(SUMMARY=summary)
-            scripts['from_summary'] = call_openai(prompt)
-        else:
-            scripts['from_summary'] = local_fallback_formatter_fromsummary(summary, lang)
-    except Exception as e:
-        scripts['from_summary'] = local_fallback_formatter_fromsummary(summary, lang)
-    # Short script
-    try:
-        if OPENAI_AVAILABLE and os.getenv("OPENAI_API_KEY"):
-            prompt = PROMPT_SHORT[lang_key].format(TOPIC=topic)
-            scripts['short'] = call_openai(prompt)
-        else:
-            scripts['short'] = local_fallback_formatter_short(topic, summary, lang)
-    except Exception as e:
-        scripts['short'] = local_fallback_formatter_short(topic, summary, lang)
+    return [{'role':r,'text':t,'duration':d,'start':st,'end':e}
+            for (r, d, st, e), t in zip(_SEG_TEMPLATE, [hook, *points, cta])]
+
+# The three script variants, in output order:
+# (variant, prompt templates, placeholder filled in, local fallback, fallback args before lang/sents)
+SCRIPT_VARIANTS = (
+    ('long',         PROMPT_LONG,         'TOPIC',   local_fallback_formatter_long,        lambda topic, summary: (topic, summary)),
+    ('from_summary', PROMPT_FROM_SUMMARY, 'SUMMARY', local_fallback_formatter_fromsummary, lambda topic, summary: (summary,)),
+    ('short',        PROMPT_SHORT,        'TOPIC',   local_fallback_formatter_short,       lambda topic, summary: (topic, summary)),
+)
+VARIANT_NAMES = tuple(v[0] for v in SCRIPT_VARIANTS)
+
+# Language-selected templates with the placeholder turned into a single %s,
+# built once at import: ("long"|"from_summary"|"short", "vi"|"en") -> template
+_PROMPTS = {
+    (variant, lang): template.replace('%', '%%').replace('{' + field + '}', '%s')
+    for variant, templates, field, _, _ in SCRIPT_VARIANTS
+    for lang, template in templates.items()
+}
+
+def build_prompts(topic: str, summary: str, lang: str = "vi"):
+    lang_key = _lang_key(lang)
+    values = {'TOPIC': topic, 'SUMMARY': summary}
+    return {variant: _PROMPTS[(variant, lang_key)] % values[field] for variant, _, field, _, _ in SCRIPT_VARIANTS}
+
+def apply_fallbacks(topic: str, summary: str, lang: str, results: dict):
+    # `results` maps variant -> generated text; a failed (exception) or missing
+    # variant falls back to its local formatter
+    sents = None
+    scripts = {}
+    for variant, _, _, fallback, fallback_args in SCRIPT_VARIANTS:
+        result = results.get(variant)
+        if isinstance(result, str):
+            scripts[variant] = result
+            continue
+        if sents is None:
+            sents = _sentences(summary)
+        scripts[variant] = fallback(*fallback_args(topic, summary), lang, sents)
     return scripts
 
-# Main processing per topic
-def process_topic(topic: str, lang: str, out_folder: str, use_ai: bool):
-    os.makedirs(out_folder, exist_ok=True)
-    safe_name = topic.replace(' ','_').replace('/','_')
-    txt_file = os.path.join(out_folder, f"script_{safe_name}.txt")
-    json_file = os.path.join(out_folder, f"script_{safe_name}.json")
-    # fetch summary
+# Generate scripts using OpenAI if available, otherwise local fallbacks.
+# The three variants are independent, so the OpenAI calls run concurrently.
+async def generate_three_scripts(topic: str, summary: str, lang: str = "vi", session=None, limiter=None, cache=None,
+                                 use_ai: bool = True):
+    if not (use_ai and _USE_AI):
+        return apply_fallbacks(topic, summary, lang, {})
+    prompts = build_prompts(topic, summary, lang)
+
+    def _gen(variant):
+        return call_openai(prompts[variant], session=session, limiter=limiter, cache=cache)
+
+    results = await asyncio.gather(*(_gen(v) for v in VARIANT_NAMES), return_exceptions=True)
+    return apply_fallbacks(topic, summary, lang, dict(zip(VARIANT_NAMES, results)))
+
+# Batch API: all prompts of a run go out as one job (cheaper, no rate-limit pressure)
+BATCH_FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+async def run_openai_batch(prompts: dict, model: str = "gpt-4o-mini", poll_interval: float = 30):
+    """Submit {custom_id: prompt} as one OpenAI Batch job, wait for it and return {custom_id: text}.
+    Requests that failed inside the batch, or whose output line is unusable, are simply
+    missing from the result."""
+    if not OPENAI_AVAILABLE:
+        raise RuntimeError("openai package not installed. pip install openai")
+    lines = []
+    for custom_id, prompt in prompts.items():
+        lines.append(json.dumps({
+            'custom_id': custom_id,
+            'method': 'POST',
+            'url': '/v1/chat/completions',
+            'body': {
+                'model': model,
+                'messages': [{"role":"user","content":prompt}],
+                'max_tokens': OPENAI_MAX_TOKENS,
+                'temperature': 0.7
+            }
+        }, ensure_ascii=False))
+    client = _get_openai_client()
+    batch_file = await client.files.create(
+        file=("batch_input.jsonl", "\n".join(lines).encode('utf-8')),
+        purpose="batch"
+    )
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    print("Batch submitted:", batch.id, f"({len(lines)} requests)")
     try:
-        summary, full = fetch_wikipedia_summary(topic, lang=lang, sentences=6)
-    except Exception as e:
-        # include exception message for debug in summary placeholder
-        summary = f"[Không lấy được Wikipedia. Lý do: {str(e)}]"
-        full = ""
-    # generate scripts (AI or fallback will be chosen inside)
-    scripts = generate_three_scripts(topic, summary, lang)
-    # produce segments/timecodes from the SHORT script
-    segments = split_script_to_segments(scripts['short'], lang=lang)
-    # save text file (human readable)
-    with open(txt_file, 'w', encoding='utf-8') as f:
-        f.write(f"# Topic: {topic}\n\n")
-        f.write("---\n\n")
-        f.write("# Summary (raw)\n\n")
-        f.write(summary + "\n\n")
-        f.write("---\n\n")
-        f.write("# Scripts\n\n")
-        f.write("## Long narrative\n\n")
-        f.write(scripts['long'] + "\n\n")
-        f.write("## From summary (story)\n\n")
-        f.write(scripts['from_summary'] + "\n\n")
-        f.write("## Short script (for Shorts)\n\n")
-        f.write(scripts['short'] + "\n\n")
-        f.write("---\n\n")
-        f.write("# Segments (timecodes)\n\n")
-        for s in segments:
-            f.write(f"{s['role'].upper()} [{s['start']}s - {s['end']}s]: {s['text']}\n")
-    # save json metadata
-    meta = {
+        while batch.status not in BATCH_FINAL_STATUSES:
+            await asyncio.sleep(poll_interval)
+            batch = await client.batches.retrieve(batch.id)
+            print("Batch status:", batch.status)
+        # expired/cancelled batches may still carry partial output
+        if not batch.output_file_id:
+            raise RuntimeError(f"Batch {batch.id} ended with status {batch.status} and no output.")
+        content = await client.files.content(batch.output_file_id)
+    except BaseException:
+        # also on Ctrl-C: the job keeps running (and billing) server-side, so leave its id behind
+        print(f"Stopped waiting for batch {batch.id} (last status: {batch.status}); "
+              f"fetch it later with client.batches.retrieve('{batch.id}') "
+              f"or stop it with client.batches.cancel('{batch.id}').")
+        raise
+    results = {}
+    for line in content.text.splitlines():
+        if not line.strip():
+            continue
+        # one bad line only costs its own request, not the whole batch
+        try:
+            item = json.loads(line)
+            resp = item.get('response') or {}
+            if resp.get('status_code') != 200:
+                continue
+            text = resp['body']['choices'][0]['message']['content']
+            if not isinstance(text, str):
+                raise TypeError(f"content is {type(text).__name__}")
+            results[item['custom_id']] = text.strip()
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+            print("Skipping unusable batch output line:", line[:80], f"({e!r})")
+    return results
+
+# Characters not allowed (or awkward) in file names on Windows/Linux -> '_', in one pass
+_SAFE_TRANS = str.maketrans({c: '_' for c in ' /\\:*?"<>|'})
+
+def unique_safe_names(topics):
+    # {topic: file-name stem}. Different topics can map to the same stem ("a b", "a_b",
+    # "a:b"), or differ only in case, which is the same file on Windows/macOS; later
+    # ones get _2, _3, ... so no topic overwrites another's output.
+    names = {}
+    taken = set()
+    for topic in topics:
+        base = name = topic.translate(_SAFE_TRANS)
+        n = 1
+        while name.casefold() in taken:
+            n += 1
+            name = f"{base}_{n}"
+        if name != base:
+            print(f"Output name for {topic!r} collides with another topic; saving as script_{name}.*")
+        taken.add(name.casefold())
+        names[topic] = name
+    return names
+
+# txt layout, assembled in memory so each file is a single write
+def _txt_header(topic: str, summary: str):
+    return "".join([
+        f"# Topic: {topic}\n\n",
+        "---\n\n",
+        "# Summary (raw)\n\n",
+        summary, "\n\n",
+        "---\n\n",
+        "# Scripts\n\n",
+    ])
+
+def _txt_segments(segments: list):
+    return "---\n\n# Segments (timecodes)\n\n" + "".join(
+        f"{s['role'].upper()} [{s['start']}s - {s['end']}s]: {s['text']}\n" for s in segments
+    )
+
+# (variant, section title) in txt order; shared by the buffered and streamed writers
+_TXT_SECTIONS = (
+    ('long', "## Long narrative"),
+    ('from_summary', "## From summary (story)"),
+    ('short', "## Short script (for Shorts)"),
+)
+
+def _format_txt(topic: str, summary: str, scripts: dict, segments: list):
+    parts = [_txt_header(topic, summary)]
+    for variant, title in _TXT_SECTIONS:
+        parts += [title, "\n\n", scripts[variant], "\n\n"]
+    parts.append(_txt_segments(segments))
+    return "".join(parts)
+
+def _output_paths(out_folder: str, safe_name: str):
+    return (os.path.join(out_folder, f"script_{safe_name}.txt"),
+            os.path.join(out_folder, f"script_{safe_name}.json"))
+
+def _build_meta(topic: str, lang: str, summary: str, scripts: dict, segments: list):
+    return {
         'topic': topic,
         'lang': lang,
         'summary': summary,
         'scripts': scripts,
         'segments': segments
     }
-    with open(json_file, 'w', encoding='utf-8') as f:
-        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+def _dump_json(meta: dict):
+    if ORJSON_AVAILABLE:
+        # same layout as json.dumps(indent=2, ensure_ascii=False), serialized in C
+        return orjson.dumps(meta, option=orjson.OPT_INDENT_2)
+    return json.dumps(meta, ensure_ascii=False, indent=2)
+
+def _write_file(path: str, data):
+    # `data` is str (utf-8 text) or bytes
+    if isinstance(data, bytes):
+        Path(path).write_bytes(data)
+    else:
+        Path(path).write_text(data, encoding='utf-8')
+
+async def _write_file_async(path: str, data):
+    # aiofiles when installed, otherwise a worker thread; either way the event loop keeps running
+    if not AIOFILES_AVAILABLE:
+        return await asyncio.to_thread(_write_file, path, data)
+    if isinstance(data, bytes):
+        async with aiofiles.open(path, 'wb') as f:
+            await f.write(data)
+    else:
+        async with aiofiles.open(path, 'w', encoding='utf-8') as f:
+            await f.write(data)
+
+async def get_summary(topic: str, lang: str, cache=None, session=None):
+    try:
+        summary, full = await fetch_wikipedia_summary_async(topic, lang=lang, sentences=6, cache=cache, session=session)
+    except Exception as e:
+        # include exception message for debug in summary placeholder
+        summary = f"[Không lấy được Wikipedia. Lý do: {str(e)}]"
+    return summary
+
+async def save_outputs(topic: str, lang: str, out_folder: str, summary: str, scripts: dict, safe_name: str = None):
+    # `safe_name` is the file-name stem from unique_safe_names; defaults to the translated topic
+    txt_file, json_file = _output_paths(out_folder, safe_name or topic.translate(_SAFE_TRANS))
+    # produce segments/timecodes from the SHORT script
+    segments = split_script_to_segments(scripts['short'], lang=lang)
+    # text file (human readable) + json metadata, written concurrently without blocking the loop
+    meta = _build_meta(topic, lang, summary, scripts, segments)
+    await asyncio.gather(
+        _write_file_async(txt_file, _format_txt(topic, summary, scripts, segments)),
+        _write_file_async(json_file, _dump_json(meta))
+    )
+    return txt_file, json_file
+
+async def stream_topic_outputs(topic: str, lang: str, out_folder: str, summary: str,
+                               session=None, limiter=None, cache=None, safe_name: str = None):
+    # Same files as save_outputs, but the txt is written while the scripts are
+    # generated: header/summary first, then each script as its chunks arrive.
+    # Variants share one file here, so they are generated one after another.
+    txt_file, json_file = _output_paths(out_folder, safe_name or topic.translate(_SAFE_TRANS))
+    prompts = build_prompts(topic, summary, lang)
+    fallbacks = None
+    scripts = dict.fromkeys(VARIANT_NAMES)
+    with open(txt_file, 'w', encoding='utf-8') as f:
+        f.write(_txt_header(topic, summary))
+        for variant, title in _TXT_SECTIONS:
+            f.write(title + "\n\n")
+            f.flush()
+            section_start = f.tell()
+
+            def rewind(section_start=section_start):
+                # drop the partial text of an interrupted attempt
+                f.seek(section_start)
+                f.truncate()
+
+            try:
+                scripts[variant] = await call_openai(prompts[variant], session=session, limiter=limiter,
+                                                     cache=cache, on_delta=f.write, on_attempt=rewind)
+            except Exception:
+                if fallbacks is None:
+                    fallbacks = apply_fallbacks(topic, summary, lang, {})
+                scripts[variant] = fallbacks[variant]
+            # replace the raw chunks (or a failed attempt) with the final text the json
+            # gets, so the finished txt is byte-for-byte what save_outputs would write
+            rewind()
+            f.write(scripts[variant])
+            f.write("\n\n")
+        segments = split_script_to_segments(scripts['short'], lang=lang)
+        f.write(_txt_segments(segments))
+    meta = _build_meta(topic, lang, summary, scripts, segments)
+    await _write_file_async(json_file, _dump_json(meta))
     return txt_file, json_file
 
+# Main processing per topic
+async def process_topic_async(topic: str, lang: str, out_folder: str, use_ai: bool, session=None, limiter=None,
+                              wiki_cache=None, ai_cache=None, stream: bool = False, safe_name: str = None):
+    summary = await get_summary(topic, lang, cache=wiki_cache, session=session)
+    if stream and use_ai and _USE_AI:
+        return await stream_topic_outputs(topic, lang, out_folder, summary,
+                                          session=session, limiter=limiter, cache=ai_cache, safe_name=safe_name)
+    # generate scripts (AI or fallback will be chosen inside)
+    scripts = await generate_three_scripts(topic, summary, lang, session=session, limiter=limiter, cache=ai_cache,
+                                           use_ai=use_ai)
+    return await save_outputs(topic, lang, out_folder, summary, scripts, safe_name=safe_name)
+
+async def process_topics_batch(topics: list, args, sem, session=None, wiki_cache=None, ai_cache=None,
+                               safe_names=None):
+    # 1) summaries concurrently, 2) one Batch job for all 3xN prompts, 3) write outputs
+    model = "gpt-4o-mini"
+
+    async def summarize(t):
+        async with sem:
+            print("Fetching summary:", t)
+            return await get_summary(t, args.lang, cache=wiki_cache, session=session)
+
+    summaries = await asyncio.gather(*(summarize(t) for t in topics))
+    prompts = {}
+    for t, summary in zip(topics, summaries):
+        for variant, prompt in build_prompts(t, summary, args.lang).items():
+            prompts[f"{t}:{variant}"] = prompt
+    results = {}
+    if ai_cache is not None:
+        # cache lookups/stores happen off the event loop, in one thread hop each
+        cache_keys = {custom_id: _ai_cache_key(model, prompt) for custom_id, prompt in prompts.items()}
+        hits = await asyncio.to_thread(ai_cache.load_many, cache_keys.values(), ('content',))
+        for custom_id, key in cache_keys.items():
+            if key in hits:
+                results[custom_id] = hits[key]['content']
+                del prompts[custom_id]
+    if prompts:
+        try:
+            fresh = await run_openai_batch(prompts, model=model, poll_interval=args.batch_poll_interval)
+        except Exception as e:
+            print("Batch failed, using local formatter:", e)
+            fresh = {}
+        if ai_cache is not None and fresh:
+            await asyncio.to_thread(ai_cache.store_many, {
+                cache_keys[custom_id]: {'content': content} for custom_id, content in fresh.items()
+            })
+        results.update(fresh)
+    for t, summary in zip(topics, summaries):
+        scripts = apply_fallbacks(t, summary, args.lang, {v: results.get(f"{t}:{v}") for v in VARIANT_NAMES})
+        txt, js = await save_outputs(t, args.lang, args.out_folder, summary, scripts,
+                                     safe_name=(safe_names or {}).get(t))
+        print("Saved:", txt, js)
+
+async def main_async(args):
+    # deduped (order kept): duplicates would write the same files concurrently,
+    # and batch custom_ids must be unique
+    topics = list(dict.fromkeys(t.strip() for t in args.topics.split(',') if t.strip()))
+    # distinct topics can still share a file name once sanitized, so names are assigned up front
+    safe_names = unique_safe_names(topics)
+    # topics are I/O-bound (Wikipedia + OpenAI), so run them together, capped by the semaphore
+    sem = asyncio.Semaphore(max(1, args.concurrency))
+    # one aiohttp session (and connection pool) for every Wikipedia and OpenAI call of the run
+    session = None
+    if AIOHTTP_AVAILABLE:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=64, limit_per_host=32, ttl_dns_cache=300)
+        )
+    limiter = RateLimiter(args.max_requests_per_minute, args.max_tokens_per_minute)
+    use_ai = not args.no_ai and _USE_AI
+    wiki_cache = ai_cache = None
+    if args.cache_ttl > 0:
+        wiki_cache = DiskCache(os.path.join(args.out_folder, '.wiki_cache'), args.cache_ttl)
+        if use_ai:
+            ai_cache = DiskCache(os.path.join(args.out_folder, '.ai_cache'), args.cache_ttl)
+
+    async def run(t):
+        async with sem:
+            print("Processing:", t)
+            txt, js = await process_topic_async(t, lang=args.lang, out_folder=args.out_folder,
+                                                use_ai=not args.no_ai, session=session, limiter=limiter,
+                                                wiki_cache=wiki_cache, ai_cache=ai_cache, stream=args.stream,
+                                                safe_name=safe_names[t])
+            print("Saved:", txt, js)
+
+    use_batch = args.batch and use_ai and OPENAI_AVAILABLE
+    if args.batch and not use_batch:
+        print("--batch needs the openai package and OPENAI_API_KEY; processing in real time.")
+    try:
+        if use_batch:
+            await process_topics_batch(topics, args, sem, session=session,
+                                       wiki_cache=wiki_cache, ai_cache=ai_cache, safe_names=safe_names)
+        else:
+            await asyncio.gather(*(run(t) for t in topics))
+    finally:
+        if session is not None:
+            await session.close()
+    print("Done.")
+
+def _positive_float(value: str):
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be > 0, got {value}")
+    return number
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--topics', required=True)
     parser.add_argument('--lang', default='vi')
     parser.add_argument('--out_folder', default='./outputs')
     parser.add_argument('--no_ai', action='store_true')
+    parser.add_argument('--concurrency', type=int, default=8, help='max topics processed at the same time')
+    parser.add_argument('--max_requests_per_minute', type=_positive_float, default=500, help='OpenAI request rate limit')
+    parser.add_argument('--max_tokens_per_minute', type=_positive_float, default=200000, help='OpenAI token rate limit')
+    parser.add_argument('--cache_ttl', type=float, default=7*24*3600,
+                        help='seconds to reuse cached Wikipedia/OpenAI responses (0 disables the cache)')
+    parser.add_argument('--stream', action='store_true',
+                        help='stream OpenAI output into the txt file as it is generated')
+    parser.add_argument('--batch', action='store_true', help='generate all scripts through one OpenAI Batch API job')
+    parser.add_argument('--batch_poll_interval', type=float, default=30, help='seconds between batch status checks')
     args = parser.parse_args()
-    topics = [t.strip() for t in args.topics.split(',') if t.strip()]
-    for t in topics:
-        print("Processing:", t)
-        txt, js = process_topic(t, lang=args.lang, out_folder=args.out_folder, use_ai=not args.no_ai)
-        print("Saved:", txt, js)
-    print("Done.")
+    # created once here; per-topic code assumes out_folder exists
+    os.makedirs(args.out_folder, exist_ok=True)
+    asyncio.run(main_async(args))
 
 if __name__ == "__main__":
     main()